@@ -1,8 +1,36 @@
+import asyncio
+import contextvars
 import inspect 
-import re
 import json
+import re
 import enum
-from typing import Callable, Optional
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Callable, Iterator, Optional
+
+try:
+  import orjson
+except ImportError:
+  orjson = None
+
+_PARAM_RE = re.compile(r'\s*(\w+):\s*(.*)')
+_TYPE_MAP = {str: 'string', int: 'integer'}
+_TOOL_CACHE = weakref.WeakKeyDictionary()
+# Integers this long may not fit in 64 bits, which orjson rounds to floats
+_LONG_NUMBER_RE = re.compile(r'\d{20,}')
+
+def _json_loads(s: str):
+  """
+  Parses JSON with orjson if it is installed, falling back to json where their results would differ:
+  orjson rounds integers that don't fit in 64 bits to floats and rejects NaN and Infinity
+  """
+  if orjson is None or _LONG_NUMBER_RE.search(s):
+    return json.loads(s)
+  try:
+    return orjson.loads(s)
+  except orjson.JSONDecodeError:
+    return json.loads(s)
 
 def parse_description(func: Callable) -> tuple[str, dict[str, str]]:
   """
@@ -11,29 +39,46 @@ def parse_description(func: Callable) -> tuple[str, dict[str, str]]:
   s = func.__doc__
   if not s:
      return '', {}
-  # Split the string into lines
-  lines = s.strip().split('\n')
+  # Iterate over the lines without copying them
+  lines = iter(s.strip().splitlines())
 
   # The first line is the top description
-  top_description = lines[0].strip()
+  top_description = next(lines, '').strip()
 
   # The rest of the lines are parameter descriptions
   param_descriptions = {}
-  for line in lines[1:]:
+  for line in lines:
+      # Lines without a colon can't be parameter descriptions, so skip the regular expression for them
+      if ':' not in line:
+          continue
       # Use a regular expression to split the line into the parameter name and description
-      match = re.match(r'\s*(\w+):\s*(.*)', line)
+      match = _PARAM_RE.match(line)
       if match:
           param_name, param_description = match.groups()
           param_descriptions[param_name] = param_description.strip()
 
   return top_description, param_descriptions
 
+@lru_cache(maxsize=None)
+def _enum_names(annotation: type) -> tuple[str, ...] | None:
+  """
+  Returns the member names of an enum type, only building them once per type
+  """
+  if issubclass(annotation, enum.Enum):
+    return tuple(e.name for e in annotation)
+  return None
+
 def map_type(param: inspect.Parameter) -> str:
   """
   Maps a parameter type to a JSON Schema type
 
   Raises a ValueError if the parameter type is not supported
   """
+  if not isinstance(param.annotation, type):
+      raise ValueError(f'Unsupported parameter type: {param.annotation}')
+  param_type = _TYPE_MAP.get(param.annotation)
+  if param_type is not None:
+      return param_type
   if issubclass(param.annotation, str):
       return 'string'
   elif issubclass(param.annotation, int):
@@ -45,15 +90,18 @@ def map_enum(param: inspect.Parameter) -> list[str] | None:
   """
   Gets the enum argument for a parameter if it is an enum, otherwise returns None
   """
-  if issubclass(param.annotation, enum.Enum):
-    return [e.name for e in param.annotation]
-  return None
+  if not isinstance(param.annotation, type):
+    return None
+  names = _enum_names(param.annotation)
+  return list(names) if names is not None else None
 
-def parse_parameters(func: Callable, param_descriptions: dict[str, str]) -> dict[str, dict[str, str] | list[str] | str]:
+def _parse_parameters(func: Callable, param_descriptions: dict[str, str]) -> tuple[dict[str, dict[str, str] | list[str] | str], list[str]]:
   """
-  Parses the parameters of a function and returns a JSON Schema object
+  Parses the parameters of a function and returns a JSON Schema object along with the required parameters,
+  checking which don't have default values
   """
   parameters = {}
+  required = []
   for name, param in inspect.signature(func).parameters.items():
       param_type = map_type(param)
       options = map_enum(param)
@@ -64,32 +112,31 @@ def parse_parameters(func: Callable, param_descriptions: dict[str, str]) -> dict
           parameters[name]['enum'] = options
       if name in param_descriptions:
           parameters[name]['description'] = param_descriptions[name]
-  return parameters
+      if param.default is inspect.Parameter.empty:
+          required.append(name)
+  return parameters, required
 
-def get_required(func: Callable) -> list[str]:
+def parse_parameters(func: Callable, param_descriptions: dict[str, str]) -> dict[str, dict[str, str] | list[str] | str]:
   """
-  Gets the required parameters for a function, checking which don't have default values
+  Parses the parameters of a function and returns a JSON Schema object
   """
-  return [name for name, param in inspect.signature(func).parameters.items() if param.default == inspect.Parameter.empty]
+  return _parse_parameters(func, param_descriptions)[0]
 
-def to_tool(func: Callable) -> dict[str, dict[str, str] | dict[str, dict[str, str]] | list[str] | str]:
+def _build_tool(func: Callable) -> dict[str, dict[str, str] | dict[str, dict[str, str]] | list[str] | str]:
   """
-  Converts a function to a tool object for use with an OpenAI-like API.
-
-  The function must contain type annotations and only have parameters that are strings, 
-  integers and can be enums of those two types. Optionally, including a docstring for the function
-  will be used as the description for the tool for the first line. Subsequent lines will be used as
-  descriptions for the parameters with the format <parameter_name>: <parameter_description>
+  Builds the tool object for a function
   """
+  name = func.__name__
   top_description, param_descriptions = parse_description(func)
+  properties, required = _parse_parameters(func, param_descriptions)
   tool = {
     'type': 'function',
     'function': {
-      'name': func.__name__,
+      'name': name,
       'parameters': {
         'type': 'object',
-        'properties': parse_parameters(func, param_descriptions),
-        'required': get_required(func), 
+        'properties': properties,
+        'required': required,
       },
     }
   }
@@ -97,30 +144,86 @@ def to_tool(func: Callable) -> dict[str, dict[str, str] | dict[str, dict[str, st
     tool['description'] = top_description
   return tool
 
+def _get_tool(func: Callable) -> dict[str, dict[str, str] | dict[str, dict[str, str]] | list[str] | str]:
+  """
+  Gets the tool object for a function, building it only once for as long as the function is alive.
+  The result is shared, so it must not be mutated.
+  """
+  try:
+    tool = _TOOL_CACHE.get(func)
+  except TypeError:
+    # Callables that are unhashable or can't be weakly referenced aren't cached
+    return _build_tool(func)
+  if tool is None:
+    tool = _TOOL_CACHE[func] = _build_tool(func)
+  return tool
+
+def _copy_tool(tool: dict[str, dict[str, str] | dict[str, dict[str, str]] | list[str] | str]) -> dict[str, dict[str, str] | dict[str, dict[str, str]] | list[str] | str]:
+  """
+  Copies a tool object so the cached one can't be mutated, copying only the known nested structure
+  which is much cheaper than a deepcopy
+  """
+  function = tool['function']
+  parameters = function['parameters']
+  properties = {}
+  for name, prop in parameters['properties'].items():
+    prop = dict(prop)
+    if 'enum' in prop:
+      prop['enum'] = list(prop['enum'])
+    properties[name] = prop
+  return {
+    **tool,
+    'function': {
+      **function,
+      'parameters': {**parameters, 'properties': properties, 'required': list(parameters['required'])},
+    },
+  }
+
+def to_tool(func: Callable) -> dict[str, dict[str, str] | dict[str, dict[str, str]] | list[str] | str]:
+  """
+  Converts a function to a tool object for use with an OpenAI-like API.
+
+  The function must contain type annotations and only have parameters that are strings, 
+  integers and can be enums of those two types. Optionally, including a docstring for the function
+  will be used as the description for the tool for the first line. Subsequent lines will be used as
+  descriptions for the parameters with the format <parameter_name>: <parameter_description>
+  """
+  return _copy_tool(_get_tool(func))
+
 class FunctionClient:
   """
   A client for interacting with a language model that supports function calls.
   """
-  def __init__(self, client, model: str, functions: list[Callable], messages: Optional[list[dict[str, str]]]=None):
+  def __init__(self, client, model: str, functions: list[Callable], messages: Optional[list[dict[str, str]]]=None, parallel_tool_calls: bool=True):
     """
     Initializes the client with a language model, functions, and messages.
 
-    client: The OpenAI-like client
+    client: The OpenAI-like client, either synchronous (OpenAI) for send_message or asynchronous (AsyncOpenAI) for asend_message
     model: The language model to use
     functions: A default list of functions to call
     messages: A list of messages to start the conversation with
+    parallel_tool_calls: Whether to run multiple tool calls from one response concurrently, defaults to True
     """
     self.messages = messages or []
     self.model = model
     self.client = client
     self.functions = functions
+    self.parallel_tool_calls = parallel_tool_calls
 
   @staticmethod
   def funcs_to_tools(funcs: list[Callable]) -> tuple[list[dict[str, dict[str, str] | dict[str, dict[str, str]] | list[str] | str]], dict[str, Callable]]:
     """
     Converts a list of functions to a list of tools and a dictionary mapping function names to functions.
     """
-    return [to_tool(func) for func in funcs], {func.__name__: func for func in funcs}
+    return [to_tool(func) for func in funcs], dict(zip((func.__name__ for func in funcs), funcs))
+
+  @staticmethod
+  def _get_tools(functions: list[Callable]) -> tuple[list[dict], dict[str, Callable]]:
+    """
+    Gets the tools and tool map for a list of functions, reusing the cached tool for each function.
+    The tools are shared with the cache, so they are only passed to the client and never mutated.
+    """
+    return [_get_tool(func) for func in functions], dict(zip((func.__name__ for func in functions), functions))
 
   def add_message(self, content: str, role: Optional[str]='user'):
     """
@@ -128,43 +231,182 @@ class FunctionClient:
     """
     self.messages.append({'role': role, 'content': content})
 
-  def __send_message(self, functions: list[Callable], force_function:Optional[str | Callable]=None, model: Optional[str]=None):
+  def __completion_args(self, tools: list[dict], force_function: Optional[str]=None, model: Optional[str]=None) -> dict:
     """
-    Sends a message to the language model and processes the response.
+    Builds the arguments for a chat completion request.
     """
-    tools, tools_map = self.funcs_to_tools(functions)
     args = {
-      'model': model,
+      'model': model or self.model,
       'messages': self.messages,
       'tools': tools,
     }
     if force_function:
        args['tool_choice'] = {"type": "function", "function": {"name": force_function}}
-    response = self.client.chat.completions.create(
-      model=self.model,
-      messages=self.messages,
-      tools=tools,
-    )
+    return args
+
+  def __send_message(self, tools: list[dict], tools_map: dict[str, Callable], force_function: Optional[str]=None, model: Optional[str]=None):
+    """
+    Sends a message to the language model and processes the response.
+    """
+    args = self.__completion_args(tools, force_function, model)
+    response = self.client.chat.completions.create(**args)
     message = response.choices[0].message
     if message.tool_calls:
-      for tool_call in message.tool_calls:
-        args = json.loads(tool_call.function.arguments)
-        result = tools_map[tool_call.function.name](**args)
-        self.messages.append({"role": "function", "tool_call_id": tool_call.id, "name": tool_call.function.name, "content": result})
+      self.__run_tool_calls(self.__tool_call_parts(message.tool_calls), tools_map)
       return False
     else:
       self.messages.append({"role": "assistant", "content": message.content})
       return True
 
-  def send_message(self, content: Optional[str]=None, role: Optional[str]=None, model: Optional[str]=None, functions: Optional[list[Callable]]=None, force_function: Optional[str | Callable]=None, num_calls: Optional[int]=100) -> str:
+  async def __asend_message(self, tools: list[dict], tools_map: dict[str, Callable], force_function: Optional[str]=None, model: Optional[str]=None):
     """
-    Sends a message to the language model and processes the response, responding to tool call requests until a text response is received.
-    Can be called without a content argument to just use current messages.
+    Sends a message to the language model with an asynchronous client and processes the response.
+    """
+    args = self.__completion_args(tools, force_function, model)
+    response = await self.client.chat.completions.create(**args)
+    message = response.choices[0].message
+    if message.tool_calls:
+      await self.__arun_tool_calls(self.__tool_call_parts(message.tool_calls), tools_map)
+      return False
+    else:
+      self.messages.append({"role": "assistant", "content": message.content})
+      return True
 
-    content: Optional, the content of the message.
-    role: Optional, the role of the message, defaults to 'user'.
-    functions: Optional, the list of functions to use, defaults to the list of functions passed to the constructor.
-    force_function: Optional, a function or the name of the function to force the model to call.
+  def __stream_message(self, tools: list[dict], tools_map: dict[str, Callable], force_function: Optional[str]=None, model: Optional[str]=None):
+    """
+    Sends a message to the language model as a stream, yielding content as it arrives and processing any tool calls.
+    Returns True if a text response was received.
+    """
+    args = self.__completion_args(tools, force_function, model)
+    content = []
+    # Tool calls are streamed in fragments keyed by their index
+    tool_calls = {}
+    response = self.client.chat.completions.create(**args, stream=True)
+    try:
+      for chunk in response:
+        if not chunk.choices:
+          continue
+        delta = chunk.choices[0].delta
+        if delta.content:
+          content.append(delta.content)
+          yield delta.content
+        for tool_call in delta.tool_calls or []:
+          parts = tool_calls.setdefault(tool_call.index, {'id': None, 'name': [], 'arguments': []})
+          if tool_call.id:
+            parts['id'] = tool_call.id
+          if tool_call.function:
+            if tool_call.function.name:
+              parts['name'].append(tool_call.function.name)
+            if tool_call.function.arguments:
+              parts['arguments'].append(tool_call.function.arguments)
+    finally:
+      # Closing the stream releases the connection even if the caller stops iterating early,
+      # streams from other OpenAI-like clients may be plain iterators without a close method
+      close = getattr(response, 'close', None)
+      if close is not None:
+        close()
+    if tool_calls:
+      # Keep any text that was streamed alongside the tool calls
+      if content:
+        self.messages.append({"role": "assistant", "content": ''.join(content)})
+      self.__run_tool_calls([
+        (parts['id'], ''.join(parts['name']), ''.join(parts['arguments']))
+        for _, parts in sorted(tool_calls.items())
+      ], tools_map)
+      return False
+    else:
+      self.messages.append({"role": "assistant", "content": ''.join(content)})
+      return True
+
+  @staticmethod
+  def __tool_call_parts(tool_calls: list) -> list[tuple[str, str, str]]:
+    """
+    Gets the id, function name and raw arguments of each tool call in a response message.
+    """
+    return [(tool_call.id, tool_call.function.name, tool_call.function.arguments) for tool_call in tool_calls]
+
+  @staticmethod
+  def __call_tool(tool_call: tuple[str, str, str], tools_map: dict[str, Callable]):
+    """
+    Calls the function for a tool call with its parsed arguments.
+    """
+    _, name, arguments = tool_call
+    return tools_map[name](**_json_loads(arguments))
+
+  def __run_tool_calls(self, tool_calls: list[tuple[str, str, str]], tools_map: dict[str, Callable]):
+    """
+    Calls the functions for each tool call and adds the results to the conversation.
+    If a call fails, the results before it are added and its exception is raised.
+    """
+    if not self.parallel_tool_calls or len(tool_calls) < 2:
+      for tool_call in tool_calls:
+        self.__add_tool_results([tool_call], [self.__call_tool(tool_call, tools_map)])
+      return
+    # Run multiple tool calls concurrently since they are typically I/O bound
+    with ThreadPoolExecutor(max_workers=len(tool_calls)) as executor:
+      futures = [
+        executor.submit(contextvars.copy_context().run, self.__call_tool, tool_call, tools_map)
+        for tool_call in tool_calls
+      ]
+    results = []
+    error = None
+    for future in futures:
+      error = future.exception()
+      if error is not None:
+        break
+      results.append(future.result())
+    self.__add_tool_results(tool_calls, results)
+    if error is not None:
+      raise error
+
+  @staticmethod
+  async def __acall_tool(tool_call: tuple[str, str, str], tools_map: dict[str, Callable]):
+    """
+    Calls the function for a tool call with its parsed arguments without blocking the event loop.
+    """
+    _, name, arguments = tool_call
+    func = tools_map[name]
+    args = _json_loads(arguments)
+    # Coroutine functions are awaited directly, regular functions are run in a thread
+    if inspect.iscoroutinefunction(func):
+      return await func(**args)
+    result = await asyncio.to_thread(func, **args)
+    # Other callables can still return awaitables, such as objects with an async __call__
+    if inspect.isawaitable(result):
+      return await result
+    return result
+
+  async def __arun_tool_calls(self, tool_calls: list[tuple[str, str, str]], tools_map: dict[str, Callable]):
+    """
+    Asynchronous version of __run_tool_calls.
+    """
+    if not self.parallel_tool_calls or len(tool_calls) < 2:
+      for tool_call in tool_calls:
+        self.__add_tool_results([tool_call], [await self.__acall_tool(tool_call, tools_map)])
+      return
+    outcomes = await asyncio.gather(*[self.__acall_tool(tool_call, tools_map) for tool_call in tool_calls], return_exceptions=True)
+    results = []
+    error = None
+    for outcome in outcomes:
+      if isinstance(outcome, BaseException):
+        error = outcome
+        break
+      results.append(outcome)
+    self.__add_tool_results(tool_calls, results)
+    if error is not None:
+      raise error
+
+  def __add_tool_results(self, tool_calls: list[tuple[str, str, str]], results: list):
+    """
+    Adds the results of tool calls to the conversation in the order they were requested.
+    """
+    for (tool_call_id, name, _), result in zip(tool_calls, results):
+      self.messages.append({"role": "function", "tool_call_id": tool_call_id, "name": name, "content": result})
+
+  def __prepare_send(self, content: Optional[str], role: Optional[str], model: Optional[str], functions: Optional[list[Callable]], force_function: Optional[str | Callable]) -> tuple[list[dict], dict[str, Callable], Optional[str], str]:
+    """
+    Adds the message and fills in the defaults shared by send_message, asend_message and stream_message.
+    Returns the tools, tool map, name of the function to force and model to use.
     """
     if content:
       self.add_message(content, role)
@@ -174,11 +416,65 @@ class FunctionClient:
        force_function = force_function.__name__
     if not model:
         model = self.model
-    done = False
-    i = 0
-    # Only force_function for the first call to avoid tool call loops
-    done = self.__send_message(functions, force_function, model=model)
-    i += 1
-    while not done and i < num_calls:
-      done = self.__send_message(functions, model=model)
+    tools, tools_map = self._get_tools(functions)
+    return tools, tools_map, force_function, model
+
+  @staticmethod
+  def __tool_choices(force_function: Optional[str], num_calls: int) -> Iterator[Optional[str]]:
+    """
+    Gets the function to force for each request, making at least one and at most num_calls requests.
+    Only force_function for the first call to avoid tool call loops.
+    """
+    yield force_function
+    for _ in range(1, num_calls):
+      yield None
+
+  def send_message(self, content: Optional[str]=None, role: Optional[str]=None, model: Optional[str]=None, functions: Optional[list[Callable]]=None, force_function: Optional[str | Callable]=None, num_calls: Optional[int]=100) -> str:
+    """
+    Sends a message to the language model and processes the response, responding to tool call requests until a text response is received.
+    Can be called without a content argument to just use current messages.
+
+    content: Optional, the content of the message.
+    role: Optional, the role of the message, defaults to 'user'.
+    functions: Optional, the list of functions to use, defaults to the list of functions passed to the constructor.
+    force_function: Optional, a function or the name of the function to force the model to call.
+    num_calls: Optional, the maximum number of requests to make to the language model, defaults to 100.
+    """
+    tools, tools_map, force_function, model = self.__prepare_send(content, role, model, functions, force_function)
+    for tool_choice in self.__tool_choices(force_function, num_calls):
+      if self.__send_message(tools, tools_map, tool_choice, model=model):
+        break
     return self.messages[-1]['content']
+
+  async def asend_message(self, content: Optional[str]=None, role: Optional[str]=None, model: Optional[str]=None, functions: Optional[list[Callable]]=None, force_function: Optional[str | Callable]=None, num_calls: Optional[int]=100) -> str:
+    """
+    Asynchronous version of send_message for use with an asynchronous OpenAI-like client such as AsyncOpenAI.
+    Functions can be either regular functions or coroutine functions.
+
+    content: Optional, the content of the message.
+    role: Optional, the role of the message, defaults to 'user'.
+    functions: Optional, the list of functions to use, defaults to the list of functions passed to the constructor.
+    force_function: Optional, a function or the name of the function to force the model to call.
+    num_calls: Optional, the maximum number of requests to make to the language model, defaults to 100.
+    """
+    tools, tools_map, force_function, model = self.__prepare_send(content, role, model, functions, force_function)
+    for tool_choice in self.__tool_choices(force_function, num_calls):
+      if await self.__asend_message(tools, tools_map, tool_choice, model=model):
+        break
+    return self.messages[-1]['content']
+
+  def stream_message(self, content: Optional[str]=None, role: Optional[str]=None, model: Optional[str]=None, functions: Optional[list[Callable]]=None, force_function: Optional[str | Callable]=None, num_calls: Optional[int]=100) -> Iterator[str]:
+    """
+    Streaming version of send_message, yielding the text of the response as it arrives instead of returning it once complete.
+    Tool calls are still handled until a text response is received, which is added to the messages once the stream ends.
+
+    content: Optional, the content of the message.
+    role: Optional, the role of the message, defaults to 'user'.
+    functions: Optional, the list of functions to use, defaults to the list of functions passed to the constructor.
+    force_function: Optional, a function or the name of the function to force the model to call.
+    num_calls: Optional, the maximum number of requests to make to the language model, defaults to 100.
+    """
+    tools, tools_map, force_function, model = self.__prepare_send(content, role, model, functions, force_function)
+    for tool_choice in self.__tool_choices(force_function, num_calls):
+      if (yield from self.__stream_message(tools, tools_map, tool_choice, model=model)):
+        break
@@ -0,0 +1,332 @@
+import asyncio
+import contextvars
+import gc
+import math
+import threading
+import unittest
+import weakref
+from typing import Optional
+from types import SimpleNamespace
+
+from llmfunctionclient.main import _TOOL_CACHE, _json_loads, FunctionClient, parse_parameters, to_tool
+
+
+def get_weather(location: str):
+  """
+  Gets the weather
+
+  location: where to get the forecast for
+  """
+  return f"The weather in {location} is 75 degrees"
+
+
+class FakeCompletions:
+  """
+  Records create calls and returns the queued responses in order.
+  """
+  def __init__(self, responses):
+    self.responses = list(responses)
+    self.calls = []
+
+  def create(self, **kwargs):
+    self.calls.append(kwargs)
+    return self.responses.pop(0)
+
+
+class FakeAsyncCompletions(FakeCompletions):
+  async def create(self, **kwargs):
+    return super().create(**kwargs)
+
+
+class FakeStream:
+  """
+  A streamed response that records whether it was closed.
+  """
+  def __init__(self, chunks):
+    self.chunks = chunks
+    self.closed = False
+
+  def __iter__(self):
+    return iter(self.chunks)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def close(self):
+    self.closed = True
+
+
+def fake_client(responses):
+  return SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions(responses)))
+
+
+def fake_async_client(responses):
+  return SimpleNamespace(chat=SimpleNamespace(completions=FakeAsyncCompletions(responses)))
+
+
+def tool_call(id, name, arguments):
+  return SimpleNamespace(id=id, function=SimpleNamespace(name=name, arguments=arguments))
+
+
+def response(content=None, tool_calls=None):
+  return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content, tool_calls=tool_calls))])
+
+
+class TestToTool(unittest.TestCase):
+  def test_non_class_annotation(self):
+    def get_forecast(days: Optional[int]):
+      pass
+    with self.assertRaisesRegex(ValueError, 'Unsupported parameter type'):
+      to_tool(get_forecast)
+
+  def test_parse_parameters(self):
+    def get_forecast(location: str, days: int = 3):
+      pass
+    self.assertEqual(parse_parameters(get_forecast, {'location': 'where'}), {
+      'location': {'type': 'string', 'description': 'where'},
+      'days': {'type': 'integer'},
+    })
+    self.assertEqual(to_tool(get_forecast)['function']['parameters']['required'], ['location'])
+
+  def test_result_can_be_mutated(self):
+    to_tool(get_weather)['function']['name'] = 'mutated'
+    self.assertEqual(to_tool(get_weather)['function']['name'], 'get_weather')
+    self.assertEqual(FunctionClient.funcs_to_tools([get_weather])[0][0]['function']['name'], 'get_weather')
+    FunctionClient.funcs_to_tools([get_weather])[0][0]['description'] = 'mutated'
+    FunctionClient.funcs_to_tools([get_weather])[0][0]['function']['parameters']['required'].append('mutated')
+    self.assertEqual(to_tool(get_weather)['description'], 'Gets the weather')
+    self.assertEqual(FunctionClient.funcs_to_tools([get_weather])[0][0]['function']['parameters']['required'], ['location'])
+
+  def test_cache_does_not_keep_functions_alive(self):
+    def make_function():
+      def get_time(location: str):
+        pass
+      return get_time
+    func = make_function()
+    to_tool(func)
+    self.assertIn(func, _TOOL_CACHE)
+    count = len(_TOOL_CACHE)
+    del func
+    gc.collect()
+    self.assertEqual(len(_TOOL_CACHE), count - 1)
+
+  def test_unhashable_callable(self):
+    class Tool(dict):
+      __name__ = 'tool'
+      def __call__(self, location: str):
+        pass
+    self.assertEqual(to_tool(Tool())['function']['name'], 'tool')
+
+
+class TestJsonLoads(unittest.TestCase):
+  def test_large_integer(self):
+    self.assertEqual(_json_loads('{"x": 123456789012345678901234567890}'), {'x': 123456789012345678901234567890})
+
+  def test_non_finite_numbers(self):
+    args = _json_loads('{"x": NaN, "y": Infinity}')
+    self.assertTrue(math.isnan(args['x']))
+    self.assertEqual(args['y'], math.inf)
+
+  def test_invalid_json(self):
+    with self.assertRaises(ValueError):
+      _json_loads('{"x": ')
+
+
+class TestFunctionClient(unittest.TestCase):
+  def test_default_functions_changed_in_place(self):
+    functions = []
+    client = FunctionClient(fake_client([response('done')]), 'model', functions)
+    functions.append(get_weather)
+    client.send_message('hi', 'user')
+    self.assertEqual(client.client.chat.completions.calls[0]['tools'], [to_tool(get_weather)])
+
+  def test_per_call_functions_not_kept_alive(self):
+    client = FunctionClient(fake_client([response('done')]), 'model', [get_weather])
+    def get_time(location: str):
+      pass
+    ref = weakref.ref(get_time)
+    client.send_message('hi', 'user', functions=[get_time])
+    del get_time
+    gc.collect()
+    self.assertIsNone(ref())
+
+  def test_parallel_tool_calls(self):
+    barrier = threading.Barrier(2, timeout=5)
+    def wait(location: str):
+      barrier.wait()
+      return location
+    client = FunctionClient(fake_client([
+      response(tool_calls=[tool_call('1', 'wait', '{"location": "LA"}'), tool_call('2', 'wait', '{"location": "NY"}')]),
+      response('done'),
+    ]), 'model', [wait])
+    self.assertEqual(client.send_message('hi', 'user'), 'done')
+    self.assertEqual([m['content'] for m in client.messages], ['hi', 'LA', 'NY', 'done'])
+
+  def test_parallel_tool_call_failure(self):
+    def tool(location: str):
+      if location == 'NY':
+        raise RuntimeError(location)
+      return location
+    client = FunctionClient(fake_client([
+      response(tool_calls=[tool_call(str(i), 'tool', f'{{"location": "{location}"}}') for i, location in enumerate(['LA', 'NY', 'SF'])]),
+    ]), 'model', [tool])
+    with self.assertRaisesRegex(RuntimeError, 'NY'):
+      client.send_message('hi', 'user')
+    self.assertEqual([m['content'] for m in client.messages], ['hi', 'LA'])
+
+  def test_sequential_tool_calls(self):
+    calls = []
+    def tool(location: str):
+      calls.append(threading.current_thread())
+      if location == 'NY':
+        raise RuntimeError(location)
+      return location
+    client = FunctionClient(fake_client([
+      response(tool_calls=[tool_call(str(i), 'tool', f'{{"location": "{location}"}}') for i, location in enumerate(['LA', 'NY', 'SF'])]),
+    ]), 'model', [tool], parallel_tool_calls=False)
+    with self.assertRaisesRegex(RuntimeError, 'NY'):
+      client.send_message('hi', 'user')
+    self.assertEqual(calls, [threading.current_thread()] * 2)
+    self.assertEqual([m['content'] for m in client.messages], ['hi', 'LA'])
+
+  def test_tool_calls_keep_context(self):
+    var = contextvars.ContextVar('var')
+    var.set('value')
+    def tool(location: str):
+      return var.get()
+    client = FunctionClient(fake_client([
+      response(tool_calls=[tool_call('1', 'tool', '{"location": "LA"}'), tool_call('2', 'tool', '{"location": "NY"}')]),
+      response('done'),
+    ]), 'model', [tool])
+    client.send_message('hi', 'user')
+    self.assertEqual([m['content'] for m in client.messages[1:3]], ['value', 'value'])
+
+  def test_force_function_and_model(self):
+    client = FunctionClient(fake_client([
+      response(tool_calls=[tool_call('1', 'get_weather', '{"location": "LA"}')]),
+      response('done'),
+    ]), 'model', [get_weather])
+    self.assertEqual(client.send_message('hi', 'user', model='other', force_function=get_weather), 'done')
+    calls = client.client.chat.completions.calls
+    self.assertEqual(calls[0]['tool_choice'], {'type': 'function', 'function': {'name': 'get_weather'}})
+    self.assertNotIn('tool_choice', calls[1])
+    self.assertEqual([call['model'] for call in calls], ['other', 'other'])
+
+  def test_num_calls(self):
+    client = FunctionClient(fake_client([
+      response(tool_calls=[tool_call(str(i), 'get_weather', '{"location": "LA"}')]) for i in range(5)
+    ]), 'model', [get_weather])
+    client.send_message('hi', 'user', num_calls=3)
+    self.assertEqual(len(client.client.chat.completions.calls), 3)
+
+
+def chunk(content=None, tool_calls=None):
+  return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content, tool_calls=tool_calls))])
+
+
+def tool_call_delta(index, id=None, name=None, arguments=None):
+  return SimpleNamespace(index=index, id=id, function=SimpleNamespace(name=name, arguments=arguments))
+
+
+class TestStreamMessage(unittest.TestCase):
+  def test_tool_call_fragments(self):
+    streams = [
+      FakeStream([
+        chunk('Checking. '),
+        chunk(tool_calls=[tool_call_delta(0, '1', 'get_weather', '{"loc'), tool_call_delta(1, '2', 'get_weather', '{"location":')]),
+        chunk(tool_calls=[tool_call_delta(1, arguments=' "NY"}'), tool_call_delta(0, arguments='ation": "LA"}')]),
+        SimpleNamespace(choices=[]),
+      ]),
+      FakeStream([chunk('It is '), chunk('75'), chunk()]),
+    ]
+    client = FunctionClient(fake_client(streams), 'model', [get_weather])
+    self.assertEqual(list(client.stream_message('hi', 'user')), ['Checking. ', 'It is ', '75'])
+    self.assertEqual(client.messages[1:], [
+      {'role': 'assistant', 'content': 'Checking. '},
+      {'role': 'function', 'tool_call_id': '1', 'name': 'get_weather', 'content': get_weather('LA')},
+      {'role': 'function', 'tool_call_id': '2', 'name': 'get_weather', 'content': get_weather('NY')},
+      {'role': 'assistant', 'content': 'It is 75'},
+    ])
+    self.assertTrue(all(stream.closed for stream in streams))
+    self.assertTrue(all(call['stream'] for call in client.client.chat.completions.calls))
+
+  def test_stopping_early_closes_stream(self):
+    stream = FakeStream([chunk('It is '), chunk('75')])
+    client = FunctionClient(fake_client([stream]), 'model', [get_weather])
+    chunks = client.stream_message('hi', 'user')
+    next(chunks)
+    chunks.close()
+    self.assertTrue(stream.closed)
+
+  def test_plain_iterator_streams(self):
+    def generator_stream():
+      yield chunk(tool_calls=[tool_call_delta(0, '1', 'get_weather', '{"location": "LA"}')])
+    client = FunctionClient(fake_client([generator_stream(), iter([chunk('It is '), chunk('75')])]), 'model', [get_weather])
+    self.assertEqual(list(client.stream_message('hi', 'user')), ['It is ', '75'])
+    self.assertEqual(client.messages[-1], {'role': 'assistant', 'content': 'It is 75'})
+
+  def test_force_function_and_num_calls(self):
+    client = FunctionClient(fake_client([
+      FakeStream([chunk(tool_calls=[tool_call_delta(0, str(i), 'get_weather', '{"location": "LA"}')])]) for i in range(5)
+    ]), 'model', [get_weather])
+    list(client.stream_message('hi', 'user', force_function='get_weather', num_calls=3))
+    calls = client.client.chat.completions.calls
+    self.assertEqual(len(calls), 3)
+    self.assertEqual(calls[0]['tool_choice'], {'type': 'function', 'function': {'name': 'get_weather'}})
+    self.assertNotIn('tool_choice', calls[1])
+
+
+class TestAsyncFunctionClient(unittest.TestCase):
+  def test_force_function_and_model(self):
+    client = FunctionClient(fake_async_client([
+      response(tool_calls=[tool_call('1', 'get_weather', '{"location": "LA"}')]),
+      response('done'),
+    ]), 'model', [get_weather])
+    self.assertEqual(asyncio.run(client.asend_message('hi', 'user', model='other', force_function=get_weather)), 'done')
+    calls = client.client.chat.completions.calls
+    self.assertEqual(calls[0]['tool_choice'], {'type': 'function', 'function': {'name': 'get_weather'}})
+    self.assertNotIn('tool_choice', calls[1])
+    self.assertEqual([call['model'] for call in calls], ['other', 'other'])
+
+  def test_num_calls(self):
+    client = FunctionClient(fake_async_client([
+      response(tool_calls=[tool_call(str(i), 'get_weather', '{"location": "LA"}')]) for i in range(5)
+    ]), 'model', [get_weather])
+    asyncio.run(client.asend_message('hi', 'user', num_calls=3))
+    self.assertEqual(len(client.client.chat.completions.calls), 3)
+
+  def test_parallel_tool_call_failure(self):
+    async def tool(location: str):
+      if location == 'NY':
+        raise RuntimeError(location)
+      await asyncio.sleep(0)
+      return location
+    def sync_tool(location: str):
+      return location
+    client = FunctionClient(fake_async_client([
+      response(tool_calls=[tool_call('1', 'tool', '{"location": "LA"}'), tool_call('2', 'sync_tool', '{"location": "SF"}'), tool_call('3', 'tool', '{"location": "NY"}')]),
+    ]), 'model', [tool, sync_tool])
+    with self.assertRaisesRegex(RuntimeError, 'NY'):
+      asyncio.run(client.asend_message('hi', 'user'))
+    self.assertEqual([m['content'] for m in client.messages], ['hi', 'LA', 'SF'])
+
+
+  def test_async_callable_object(self):
+    class GetTime:
+      __name__ = 'get_time'
+      async def __call__(self, location: str):
+        await asyncio.sleep(0)
+        return f'noon in {location}'
+    client = FunctionClient(fake_async_client([
+      response(tool_calls=[tool_call('1', 'get_time', '{"location": "LA"}')]),
+      response('done'),
+    ]), 'model', [GetTime()])
+    asyncio.run(client.asend_message('hi', 'user'))
+    self.assertEqual(client.messages[1]['content'], 'noon in LA')
+
+
+if __name__ == '__main__':
+  unittest.main()